@@ -157,12 +157,12 @@ class RFNotes:
             )
             stixnote.from_json(note)
             stixnote.create_relations()
-            bundle = stixnote.to_stix_bundle()
+            stix_objects = stixnote.to_stix_objects()
             self.helper.log_info(
-                "Sending Bundle to server with " + str(len(bundle.objects)) + " objects"
+                "Sending Bundle to server with " + str(len(stix_objects)) + " objects"
             )
             self.helper.send_stix2_bundle(
-                bundle.serialize(),
+                stixnote.to_json_bundle(stix_objects),
                 update=self.update_existing_data,
             )
 
@@ -9,9 +9,11 @@
 ################################################################################
 """
 import json
+from concurrent.futures import ThreadPoolExecutor
 from urllib import parse
 
 import requests
+import requests.adapters
 import requests.exceptions
 
 API_BASE = "https://api.recordedfuture.com"
@@ -22,6 +24,7 @@ NOTES_SEARCH = NOTES_BASE + "/search"
 FUSION_FILE_BASE = CONNECT_BASE + "/fusion/files"
 THREAT_ACTOR_PATH = "/public/opencti/threat_actors.json"
 INSIKT_SOURCE = "VKz42X"
+RISK_SCORE_WORKERS = 16
 
 
 class RFClient:
@@ -33,6 +36,9 @@ class RFClient:
         headers = {"X-RFToken": token, "User-Agent": header}
         self.session = requests.Session()
         self.session.headers.update(headers)
+        # Keep a connection per risk score worker instead of the default 10
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=RISK_SCORE_WORKERS)
+        self.session.mount("https://", adapter)
         self.helper = helper
 
     def get_notes(
@@ -135,3 +141,18 @@ class RFClient:
         )
         res.raise_for_status()
         return res.json()["data"]["risk"]["score"]
+
+    def get_risk_scores_bulk(self, indicators: list) -> list:
+        """Gets risk scores for a batch of indicators, fetched concurrently
+        Args:
+            * indicators: list of (indicator type, indicator value) tuples
+        Returns:
+            The risk scores as a list of ints, in the order of indicators
+        """
+        if not indicators:
+            return []
+        workers = min(RISK_SCORE_WORKERS, len(indicators))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(
+                executor.map(lambda args: self.get_risk_score(*args), indicators)
+            )
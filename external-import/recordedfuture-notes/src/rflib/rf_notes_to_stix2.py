@@ -9,18 +9,73 @@
 ################################################################################
 """
 
-from datetime import datetime
-
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from itertools import chain
+from types import MappingProxyType
+
+import orjson
 import pycti  # type: ignore
 import stix2
-
-TLP_MAP = {
-    "white": stix2.TLP_WHITE,
-    "green": stix2.TLP_GREEN,
-    "amber": stix2.TLP_AMBER,
-    "red": stix2.TLP_RED,
+from stix2.utils import format_datetime
+
+# Keys are lowercase, callers normalize the TLP name before the lookup
+TLP_MAP = MappingProxyType(
+    {
+        "white": stix2.TLP_WHITE,
+        "green": stix2.TLP_GREEN,
+        "amber": stix2.TLP_AMBER,
+        "red": stix2.TLP_RED,
+    }
+)
+
+# Skeletons of the STIX2 objects built for indicators of compromise. Building
+# plain dicts avoids running the stix2 validators for every IOC of a note.
+_INDICATOR_TEMPLATE = {
+    "type": "indicator",
+    "spec_version": "2.1",
+    "pattern_type": "stix",
+}
+_REL_TEMPLATE = {
+    "type": "relationship",
+    "spec_version": "2.1",
 }
-{}
+_OBS_TEMPLATES = {
+    "ipv4-addr": {"type": "ipv4-addr", "spec_version": "2.1"},
+    "domain-name": {"type": "domain-name", "spec_version": "2.1"},
+    "url": {"type": "url", "spec_version": "2.1"},
+    "file": {"type": "file", "spec_version": "2.1"},
+}
+# Supported detection rule formats
+_DETECTION_RULE_TYPES = frozenset({"yara", "snort", "sigma"})
+# Supported file hash algorithms, by length of the hex digest
+_HASH_LEN_TO_ALG = {64: "SHA-256", 40: "SHA-1", 32: "MD5"}
+# Namespace used by stix2 to generate deterministic observable ids
+_SCO_ID_NAMESPACE = uuid.UUID("00abedb4-aa42-466c-9c01-fed23315a9b7")
+
+
+def _create_obs_dict(type_, **properties):
+    """Creates a STIX2 observable as a dict, with the same id stix2 would generate"""
+    id_contrib = orjson.dumps(properties, option=orjson.OPT_SORT_KEYS).decode()
+    obs = _OBS_TEMPLATES[type_].copy()
+    obs["id"] = f"{type_}--{uuid.uuid5(_SCO_ID_NAMESPACE, id_contrib)}"
+    obs.update(properties)
+    return obs
+
+
+def _serialize_bundle(objects):
+    """Serializes a list of STIX2 objects (stix2 objects or dicts) to a JSON Bundle"""
+    bundle = {
+        "type": "bundle",
+        "id": f"bundle--{uuid.uuid4()}",
+        "objects": [
+            obj if isinstance(obj, dict) else orjson.Fragment(obj.serialize())
+            for obj in objects
+        ],
+    }
+    return orjson.dumps(bundle).decode()
 
 
 class ConversionError(Exception):
@@ -29,14 +84,17 @@ class ConversionError(Exception):
     pass
 
 
+@dataclass(slots=True, eq=False)
 class RFStixEntity:
     """Parent class"""
 
-    def __init__(self, name, type_, author):
-        self.name = name
-        self.type = type_
-        self.author = author
-        self.stix_obj = None
+    name: str
+    type: str
+    author: stix2.Identity
+    stix_obj: object = None
+
+    # Build validated stix2 objects instead of plain dicts
+    _use_stix2_validation = False
 
     def to_stix_objects(self):
         """Returns a list of STIX objects"""
@@ -54,19 +112,20 @@ class RFStixEntity:
 
     def to_json_bundle(self):
         """Returns STIX Bundle as JSON"""
-        return self.to_stix_bundle().serialize()
+        if self._use_stix2_validation:
+            return self.to_stix_bundle().serialize()
+        return _serialize_bundle(self.to_stix_objects())
 
 
+@dataclass(slots=True, eq=False)
 class Indicator(RFStixEntity):
     """Base class for Indicators of Compromise (IP, Hash, URL, Domain)"""
 
-    def __init__(self, name, type_, author):
-        self.name = name
-        self.author = author
-        self.stix_indicator = None
-        self.stix_observable = None
-        self.stix_relationship = None
-        self.risk_score = None
+    stix_indicator: object = None
+    stix_observable: object = None
+    stix_relationship: object = None
+    risk_score: int = None
+    valid_from: datetime = None
 
     def to_stix_objects(self):
         """Returns a list of STIX objects"""
@@ -86,18 +145,35 @@ class Indicator(RFStixEntity):
 
     def _create_indicator(self):
         """Creates and returns STIX2 indicator object"""
-        return stix2.Indicator(
-            id=pycti.Indicator.generate_id(self._create_pattern()),
+        pattern = self._create_pattern()
+        if self.valid_from is None:
+            self.valid_from = datetime.now()
+        if self._use_stix2_validation:
+            return stix2.Indicator(
+                id=pycti.Indicator.generate_id(pattern),
+                name=self.name,
+                pattern_type="stix",
+                valid_from=self.valid_from,
+                pattern=pattern,
+                created_by_ref=self.author.id,
+                custom_properties={
+                    "x_opencti_score": self.risk_score,
+                },
+            )
+        created = format_datetime(datetime.now(timezone.utc))
+        indicator = _INDICATOR_TEMPLATE.copy()
+        indicator.update(
+            id=pycti.Indicator.generate_id(pattern),
+            created=created,
+            modified=created,
             name=self.name,
-            pattern_type="stix",
-            valid_from=datetime.now(),
-            pattern=self._create_pattern(),
+            pattern=pattern,
+            valid_from=format_datetime(self.valid_from),
             created_by_ref=self.author.id,
-            custom_properties={
-                "x_opencti_score": self.risk_score,
-            },
         )
-        pass
+        if self.risk_score is not None:
+            indicator["x_opencti_score"] = self.risk_score
+        return indicator
 
     def _create_pattern(self):
         """Creates STIX2 pattern for indicator"""
@@ -109,17 +185,34 @@ class Indicator(RFStixEntity):
 
     def _create_rel(self):
         """Creates Relationship object linking indicator and observable"""
-        return stix2.Relationship(
+        indicator_id = self.stix_indicator["id"]
+        observable_id = self.stix_observable["id"]
+        if self._use_stix2_validation:
+            return stix2.Relationship(
+                id=pycti.StixCoreRelationship.generate_id(
+                    "based-on", indicator_id, observable_id
+                ),
+                relationship_type="based-on",
+                source_ref=indicator_id,
+                target_ref=observable_id,
+                created_by_ref=self.author.id,
+            )
+        relationship = _REL_TEMPLATE.copy()
+        relationship.update(
             id=pycti.StixCoreRelationship.generate_id(
-                "based-on", self.stix_indicator.id, self.stix_observable.id
+                "based-on", indicator_id, observable_id
             ),
+            created=self.stix_indicator["created"],
+            modified=self.stix_indicator["modified"],
             relationship_type="based-on",
-            source_ref=self.stix_indicator.id,
-            target_ref=self.stix_observable.id,
+            source_ref=indicator_id,
+            target_ref=observable_id,
             created_by_ref=self.author.id,
         )
+        return relationship
 
 
+@dataclass(slots=True, eq=False)
 class IPAddress(Indicator):
     """Converts IP address to IP indicator and observable"""
 
@@ -128,9 +221,12 @@ class IPAddress(Indicator):
         return f"[ipv4-addr:value = '{self.name}']"
 
     def _create_obs(self):
-        return stix2.IPv4Address(value=self.name)
+        if self._use_stix2_validation:
+            return stix2.IPv4Address(value=self.name)
+        return _create_obs_dict("ipv4-addr", value=self.name)
 
 
+@dataclass(slots=True, eq=False)
 class Domain(Indicator):
     """Converts Domain to Domain indicator and observable"""
 
@@ -138,62 +234,78 @@ class Domain(Indicator):
         return f"[domain-name:value = '{self.name}']"
 
     def _create_obs(self):
-        return stix2.DomainName(value=self.name)
+        if self._use_stix2_validation:
+            return stix2.DomainName(value=self.name)
+        return _create_obs_dict("domain-name", value=self.name)
 
 
+@dataclass(slots=True, eq=False)
 class URL(Indicator):
     """Converts URL to URL indicator and observable"""
 
     def _create_pattern(self):
+        # Two str.replace passes are faster than a single str.translate here
         ioc = self.name.replace("\\", "\\\\")
         ioc = ioc.replace("'", "\\'")
         return f"[url:value = '{ioc}']"
 
     def _create_obs(self):
-        return stix2.URL(value=self.name)
+        if self._use_stix2_validation:
+            return stix2.URL(value=self.name)
+        return _create_obs_dict("url", value=self.name)
 
 
+@dataclass(slots=True, eq=False)
 class FileHash(Indicator):
     """Converts Hash to File indicator and observable"""
 
-    def __init__(self, name, type_, author):
-        super().__init__(name, type_, author)
+    algorithm: str = field(init=False, default=None)
+
+    # Also reject hashes that are not hexadecimal strings
+    _strict = False
+
+    def __post_init__(self):
         self.algorithm = self._determine_algorithm()
 
     def _determine_algorithm(self):
         """Determine file hash algorithm from length"""
-        if len(self.name) == 64:
-            return "SHA-256"
-        elif len(self.name) == 40:
-            return "SHA-1"
-        elif len(self.name) == 32:
-            return "MD5"
-        msg = (
-            f"Could not determine hash type for {self.name}. Only MD5, SHA1"
-            " and SHA256 hashes are supported"
-        )
-        raise ConversionError(msg)
+        algorithm = _HASH_LEN_TO_ALG.get(len(self.name))
+        if algorithm is None:
+            msg = (
+                f"Could not determine hash type for {self.name}. Only MD5, SHA1"
+                " and SHA256 hashes are supported"
+            )
+            raise ConversionError(msg)
+        if self._strict:
+            try:
+                bytes.fromhex(self.name)
+            except ValueError:
+                msg = f"Hash {self.name} is not a valid hexadecimal string"
+                raise ConversionError(msg)
+        return algorithm
 
     def _create_pattern(self):
         return f"[file:hashes.'{self.algorithm}' = '{self.name}']"
 
     def _create_obs(self):
-        return stix2.File(hashes={self.algorithm: self.name})
+        if self._use_stix2_validation:
+            return stix2.File(hashes={self.algorithm: self.name})
+        return _create_obs_dict("file", hashes={self.algorithm: self.name})
 
 
+@dataclass(slots=True, eq=False)
 class TLPMarking(RFStixEntity):
     """Creates TLP marking for report"""
 
     def create_stix_objects(self):
         """Creates STIX objects from object attributes"""
-        self.stix_obj = stix2.AttackPattern(
-            id=pycti.AttackPattern.generate_id(self.name, self.name),
-            name=self.name,
-            created_by_ref=self.author.id,
-            custom_properties={"x_mitre_id": self.name},
-        )
+        self.stix_obj = TLP_MAP.get(self.name.lower())
+        if self.stix_obj is None:
+            msg = f"TLP marking {self.name} is not supported"
+            raise ConversionError(msg)
 
 
+@dataclass(slots=True, eq=False)
 class TTP(RFStixEntity):
     """Converts MITRE T codes to AttackPattern"""
 
@@ -207,6 +319,7 @@ class TTP(RFStixEntity):
         )
 
 
+@dataclass(slots=True, eq=False)
 class Identity(RFStixEntity):
     """Converts various RF entity types to a STIX2 Identity"""
 
@@ -219,10 +332,11 @@ class Identity(RFStixEntity):
 
     def create_stix_objects(self):
         """Creates STIX objects from object attributes"""
+        identity_class = self.create_id_class()
         self.stix_obj = stix2.Identity(
-            id=pycti.Identity.generate_id(self.name, self.create_id_class()),
+            id=pycti.Identity.generate_id(self.name, identity_class),
             name=self.name,
-            identity_class=self.create_id_class(),
+            identity_class=identity_class,
             created_by_ref=self.author.id,
         )
 
@@ -231,6 +345,7 @@ class Identity(RFStixEntity):
         return self.type_to_class[self.type]
 
 
+@dataclass(slots=True, eq=False)
 class ThreatActor(RFStixEntity):
     """Converts various RF Threat Actor Organization to a STIX2 Threat Actor"""
 
@@ -253,6 +368,7 @@ class ThreatActor(RFStixEntity):
         return self.type_to_class[self.type]
 
 
+@dataclass(slots=True, eq=False)
 class IntrusionSet(RFStixEntity):
     """Converts Threat Actor to Intrusion Set SDO"""
 
@@ -265,6 +381,7 @@ class IntrusionSet(RFStixEntity):
         )
 
 
+@dataclass(slots=True, eq=False)
 class Malware(RFStixEntity):
     """Converts Malware to a Malware SDO"""
 
@@ -278,6 +395,7 @@ class Malware(RFStixEntity):
         )
 
 
+@dataclass(slots=True, eq=False)
 class Vulnerability(RFStixEntity):
     """Converts a CyberVulnerability to a Vulnerability SDO"""
 
@@ -291,19 +409,24 @@ class Vulnerability(RFStixEntity):
         )
 
 
+@dataclass(slots=True, init=False, eq=False)
 class DetectionRule(RFStixEntity):
     """Represents a Yara, Sigma or SNORT rule"""
 
-    def __init__(self, name, type_, content, author):
+    content: str = None
+    valid_from: datetime = None
+
+    def __init__(self, name, type_, content, author, valid_from=None):
         # TODO: possibly need to accomodate multi-rule. Right now just shoving everything in one
 
-        self.name = name.split(".")[0]
+        self.name = name.partition(".")[0]
         self.type = type_
         self.content = content
-        self.stix_obj = None
         self.author = author
+        self.valid_from = valid_from
+        self.stix_obj = None
 
-        if self.type not in ("yara", "snort", "sigma"):
+        if self.type not in _DETECTION_RULE_TYPES:
             msg = f"Detection rule of type {self.type} is not supported"
             raise ConversionError(msg)
 
@@ -314,28 +437,20 @@ class DetectionRule(RFStixEntity):
             name=self.name,
             pattern_type=self.type,
             pattern=self.content,
-            valid_from=datetime.now(),
+            valid_from=self.valid_from or datetime.now(),
             created_by_ref=self.author.id,
         )
 
 
+@dataclass(slots=True, eq=False)
 class Software(RFStixEntity):
-    def __init__(self, name, type_, author):
-        self.name = name
-        self.software_object = None
-
-    def to_stix_objects(self):
-        """Returns a list of STIX objects"""
-        if not self.software_object:
-            self.create_stix_objects()
-        return [self.software_object]
-
     def create_stix_objects(self):
-        self.software_object = stix2.Software(
+        self.stix_obj = stix2.Software(
             name=self.name,
         )
 
 
+@dataclass(slots=True, eq=False)
 class Location(RFStixEntity):
     rf_type_to_stix = {
         "Country": "Country",
@@ -343,38 +458,24 @@ class Location(RFStixEntity):
         "ProvinceOrState": "Administrative-Area",
     }
 
-    def __init__(self, name, type_, author):
-        self.name = name
-        self.type = self.rf_type_to_stix[type_]
-        self.location_object = None
-
-    def to_stix_objects(self):
-        """Returns a list of STIX objects"""
-        if not self.location_object:
-            self.create_stix_objects()
-        return [self.location_object]
+    def __post_init__(self):
+        self.type = self.rf_type_to_stix[self.type]
 
     def create_stix_objects(self):
-        self.location_object = stix2.Location(
+        # STIX2 requires one of region, country or latitude/longitude on every
+        # location, so country is also set for cities and administrative areas.
+        # OpenCTI relies on x_opencti_location_type for the actual location type
+        self.stix_obj = stix2.Location(
             name=self.name,
             country=self.name,
             custom_properties={"x_opencti_location_type": self.type},
         )
 
 
+@dataclass(slots=True, eq=False)
 class Campaign(RFStixEntity):
-    def __init__(self, name, type_, author):
-        self.name = name
-        self.campaign_object = None
-
-    def to_stix_objects(self):
-        """Returns a list of STIX objects"""
-        if not self.campaign_object:
-            self.create_stix_objects()
-        return [self.campaign_object]
-
     def create_stix_objects(self):
-        self.campaign_object = stix2.Campaign(
+        self.stix_obj = stix2.Campaign(
             name=self.name,
         )
 
@@ -406,6 +507,8 @@ INDICATOR_TYPE_URL_MAPPER = {
     "URL": "url",
     "Hash": "hash",
 }
+# RF types that are converted to indicators and carry a risk score
+_RISK_SCORE_TYPES = frozenset(INDICATOR_TYPE_URL_MAPPER)
 
 
 class StixNote:
@@ -438,6 +541,9 @@ class StixNote:
         "YARA Rule": "Indicator",
     }
 
+    # Build relationships and bundles through stix2 instead of plain dicts
+    _use_stix2_validation = False
+
     def __init__(
         self,
         opencti_helper,
@@ -453,17 +559,21 @@ class StixNote:
         self.name = None
         self.text = None
         self.published = datetime.now()
+        self._valid_from = None
+        self._created = None
         self.labels = None
         self.report_types = None
         self.external_references = []
         self.objects = []
+        # (type, name) of the entities already converted into self.objects
+        self._converted_entities = set()
         self.helper = opencti_helper
         self.tas = tas
         self.person_to_ta = person_to_ta
         self.ta_to_intrusion_set = ta_to_intrusion_set
         self.risk_as_score = risk_as_score
         self.risk_threshold = risk_threshold
-        self.tlp = TLP_MAP.get(tlp.lower(), None)
+        self.tlp = TLP_MAP.get(tlp.lower())
         self.rfapi = rfapi
 
     def _create_author(self):
@@ -479,10 +589,37 @@ class StixNote:
         refs = []
         for url in urls:
             external_url = url["name"]
-            source_name = external_url.split("/")[2].split(".")[-2]
+            # Second-level domain name of the url, e.g. "example" for www.example.com
+            host = external_url.split("/", 3)[2]
+            if "@" in host:
+                host = host.rpartition("@")[2]
+            if ":" in host:
+                host = host.partition(":")[0]
+            parts = host.rsplit(".", 2)
+            source_name = parts[-2] if len(parts) >= 2 else host
             refs.append({"source_name": source_name, "url": external_url})
         return refs
 
+    def _get_risk_scores(self, entities):
+        """Fetches the risk scores of the note indicators in a single batch"""
+        if not (self.risk_threshold or self.risk_as_score):
+            return {}
+        indicators = []
+        for entity in entities:
+            type_ = entity["type"]
+            if type_ in _RISK_SCORE_TYPES:
+                key = (type_, entity["name"])
+                if entity["id"] not in self.tas and key not in self._converted_entities:
+                    indicators.append(key)
+        # Each indicator is fetched once, even if the note lists it several times
+        indicators = list(dict.fromkeys(indicators))
+        if not indicators:
+            return {}
+        risk_scores = self.rfapi.get_risk_scores_bulk(
+            [(INDICATOR_TYPE_URL_MAPPER[type_], name) for type_, name in indicators]
+        )
+        return dict(zip(indicators, risk_scores))
+
     def from_json(self, note):
         """Converts to STIX Bundle from JSON objects"""
         # TODO: catch errors in for loop here
@@ -490,14 +627,26 @@ class StixNote:
         self.name = attr["title"]
         self.text = attr["text"]
         self.published = attr["published"]
+        self._valid_from = datetime.now()
+        self._created = datetime.now(timezone.utc)
         self.external_references = self._generate_external_references(
             attr.get("validation_urls", [])
         )
         self.report_types = self._create_report_types(attr.get("topic", []))
         self.labels = [topic["name"] for topic in attr.get("topic", [])]
-        for entity in attr.get("note_entities", []):
+        entities = attr.get("note_entities", [])
+        risk_scores = self._get_risk_scores(entities)
+        seen = set()
+        # STIX objects of each entity, added to self.objects once at the end
+        staged = []
+        for entity in entities:
             type_ = entity["type"]
             name = entity["name"]
+            key = (type_, name)
+            # Notes often list the same entity several times, only keep the first one
+            if key in seen or key in self._converted_entities:
+                continue
+            seen.add(key)
             if self.person_to_ta and type_ == "Person":
                 stix_objs = ThreatActor(name, type_, self.author).to_stix_objects()
             elif entity["id"] in self.tas:
@@ -515,42 +664,31 @@ class StixNote:
                 continue
             else:
                 rf_object = ENTITY_TYPE_MAPPER[type_](name, type_, self.author)
-                if type_ in [
-                    "IpAddress",
-                    "InternetDomainName",
-                    "URL",
-                    "Hash",
-                ]:
-                    risk_score = None
+                if type_ in _RISK_SCORE_TYPES:
+                    rf_object.valid_from = self._valid_from
+                    risk_score = risk_scores.get((type_, name))
                     if self.risk_threshold:
                         # If a min threshold was defined, we ignore the indicator if the score is lower than the defined threshold
-                        risk_score = self.rfapi.get_risk_score(
-                            INDICATOR_TYPE_URL_MAPPER[type_], name
-                        )
                         if risk_score < self.risk_threshold:
                             self.helper.log_info(
                                 f"Ignoring entity {name} as its risk score is lower than the defined risk threshold"
                             )
                             continue
                     if self.risk_as_score:
-                        # We get the risk_score if it was already set. Otherwise, we get it from the API
-                        rf_object.risk_score = (
-                            risk_score
-                            if risk_score
-                            else self.rfapi.get_risk_score(
-                                INDICATOR_TYPE_URL_MAPPER[type_], name
-                            )
-                        )
+                        rf_object.risk_score = risk_score
                 stix_objs = rf_object.to_stix_objects()
-            self.objects.extend(stix_objs)
+            self._converted_entities.add(key)
+            staged.append(stix_objs)
         if "attachment_content" in attr:
             rule = DetectionRule(
                 attr["attachment"],
                 attr["attachment_type"],
                 attr["attachment_content"],
                 self.author,
+                valid_from=self._valid_from,
             )
-            self.objects.extend(rule.to_stix_objects())
+            staged.append(rule.to_stix_objects())
+        self.objects.extend(chain.from_iterable(staged))
 
     RELATIONSHIPS_MAPPER = [
         {
@@ -590,62 +728,82 @@ class StixNote:
             ],
         },
     ]
+    # RELATIONSHIPS_MAPPER indexed by source type, built once at class creation
+    # and shared by all instances: ((target type, relation), ...)
+    _REL_MAP: dict[str, tuple[tuple[str, str], ...]] = {
+        entry["from"]: tuple((to["entity"], to["relation"]) for to in entry["to"])
+        for entry in RELATIONSHIPS_MAPPER
+    }
 
-    def _create_rel(self, from_id, to_id, relation):
+    def _create_rel(self, from_id, to_id, relation, created=None):
         """Creates Relationship object"""
-        return stix2.Relationship(
+        if self._use_stix2_validation:
+            return stix2.Relationship(
+                id=pycti.StixCoreRelationship.generate_id(relation, from_id, to_id),
+                relationship_type=relation,
+                source_ref=from_id,
+                target_ref=to_id,
+                created_by_ref=self.author.id,
+            )
+        if created is None:
+            created = format_datetime(datetime.now(timezone.utc))
+        relationship = _REL_TEMPLATE.copy()
+        relationship.update(
             id=pycti.StixCoreRelationship.generate_id(relation, from_id, to_id),
+            created=created,
+            modified=created,
             relationship_type=relation,
             source_ref=from_id,
             target_ref=to_id,
             created_by_ref=self.author.id,
         )
+        return relationship
 
     def create_relations(self):
+        """Creates relationships between the objects of the note"""
+        created = format_datetime(self._created or datetime.now(timezone.utc))
+        objects_by_type = defaultdict(list)
+        for obj in self.objects:
+            objects_by_type[obj["type"]].append(obj)
         relationships = []
         for source_entity in self.objects:
-            entity_possible_relationships = list(
-                filter(
-                    lambda obj: obj["from"] == source_entity["type"],
-                    self.RELATIONSHIPS_MAPPER,
-                )
-            )
-            if len(entity_possible_relationships) != 0:
-                for to_entity in entity_possible_relationships[0]["to"]:
-                    target_entities = list(
-                        filter(
-                            lambda obj: obj["type"] == to_entity["entity"], self.objects
-                        )
-                    )
-                    for target_entity in target_entities:
-                        if (
-                            to_entity["entity"] != "identity"
-                            or target_entity["identity_class"] == "class"
-                        ):
-                            relationships.append(
-                                self._create_rel(
-                                    source_entity["id"],
-                                    target_entity["id"],
-                                    to_entity["relation"],
-                                )
+            for target_type, relation in self._REL_MAP.get(source_entity["type"], ()):
+                for target_entity in objects_by_type[target_type]:
+                    if (
+                        target_type != "identity"
+                        or target_entity.get("identity_class") == "class"
+                    ):
+                        relationships.append(
+                            self._create_rel(
+                                source_entity["id"],
+                                target_entity["id"],
+                                relation,
+                                created,
                             )
+                        )
         self.objects.extend(relationships)
 
     def _create_report_types(self, topics):
         """Converts Insikt Topics to STIX2 Report types"""
         ret = set()
+        missing = []
         for topic in topics:
             name = topic["name"]
-            if name not in self.report_type_mapper:
-                self.helper.log_warning(
-                    "Could not map a report type for type {}".format(name)
-                )
+            report_type = self.report_type_mapper.get(name)
+            if report_type is None:
+                missing.append(name)
                 continue
-            ret.add(self.report_type_mapper[name])
+            ret.add(report_type)
+        if missing:
+            self.helper.log_warning(
+                "Could not map a report type for types {}".format(", ".join(missing))
+            )
         return list(ret)
 
     def to_stix_objects(self):
         """Returns a list of STIX objects"""
+        object_refs = [obj["id"] for obj in self.objects]
+        object_refs.append(self.author.id)
         report = stix2.Report(
             id=pycti.Report.generate_id(self.name, self.published),
             name=self.name,
@@ -654,16 +812,23 @@ class StixNote:
             created_by_ref=self.author.id,
             labels=self.labels,
             report_types=self.report_types,
-            object_refs=[obj.id for obj in self.objects] + [self.author.id],
+            object_refs=object_refs,
             external_references=self.external_references,
             object_marking_refs=self.tlp,
         )
-        return self.objects + [report, self.author, self.tlp]
+        return [*self.objects, report, self.author, self.tlp]
 
     def to_stix_bundle(self):
         """Returns STIX objects as a Bundle"""
         return stix2.Bundle(objects=self.to_stix_objects(), allow_custom=True)
 
-    def to_json_bundle(self):
-        """Returns STIX Bundle as JSON"""
-        return self.to_stix_bundle().serialize()
+    def to_json_bundle(self, objects=None):
+        """Returns STIX Bundle as JSON
+        Args:
+            * objects: STIX objects to bundle, defaults to to_stix_objects()
+        """
+        if objects is None:
+            objects = self.to_stix_objects()
+        if self._use_stix2_validation:
+            return stix2.Bundle(objects=objects, allow_custom=True).serialize()
+        return _serialize_bundle(objects)